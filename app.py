@@ -1,117 +1,165 @@
 import streamlit as st
-from datetime import datetime, timedelta
+import numpy as np
+import io
 import re
 
+# One timecoded line: "[HH:MM:SS.cc] text", matched on the raw file bytes.
+# Lines may end in \n, \r\n or a bare \r (classic Mac / Avid exports)
+LINE_RE = re.compile(rb"(?:^|(?<=\r))\[(\d{2}):(\d{2}):(\d{2})\.(\d{2})\][ \t]*([^\r\n]*)", re.MULTILINE)
+# A frame rate in a file name, not part of a longer number (e.g. "clip_29.97.txt")
+FPS_RE = re.compile(r"(?<!\d)(29\.97|59\.94|23\.976|60|30|25|24)(?!\d)")
+
 # -----------------------
 # Helper functions
 # -----------------------
-def drop_frame_adjust(time_in_seconds, fps):
-    if fps not in [29.97, 59.94]:
-        return timedelta(seconds=time_in_seconds)
-    total_frames = round(time_in_seconds * fps)
-    drop_frames = 2 if fps == 29.97 else 4
-    frames_per_10_minutes = round(fps * 60 * 10)
-    frames_per_minute = round(fps * 60)
-    d = total_frames // frames_per_10_minutes
-    m = total_frames % frames_per_10_minutes
-    dropped = drop_frames * (9 * d + max(0, (m - drop_frames) // (frames_per_minute - drop_frames)))
+# Drop-frame rates: (frames dropped per minute, frames per minute, frames per 10 minutes)
+DROP_FRAME_RATES = {
+    29.97: (2, round(29.97 * 60), round(29.97 * 60 * 10)),
+    59.94: (4, round(59.94 * 60), round(59.94 * 60 * 10)),
+}
+
+def drop_frame_adjust(times, fps):
+    # Adjusts a whole array of times (seconds) in one pass; fps must be a drop-frame rate
+    drop_frames, frames_per_minute, frames_per_10_minutes = DROP_FRAME_RATES[fps]
+    total_frames = np.rint(times * fps).astype(np.int64)
+    d, m = np.divmod(total_frames, frames_per_10_minutes)
+    dropped = drop_frames * (9 * d + np.maximum(0, (m - drop_frames) // (frames_per_minute - drop_frames)))
     adjusted_frames = total_frames - dropped
-    return timedelta(seconds=adjusted_frames / fps)
+    return adjusted_frames / fps
 
 def detect_framerate(file_name):
-    name = file_name.lower()
-    for val in ["29.97", "30", "25", "24"]:
-        if val in name:
-            return float(val)
-    return 25.0
-
-def parse_timecode(tc):
-    return datetime.strptime(tc, "%H:%M:%S.%f")
-
-def fmt_srt(dt):
-    return dt.strftime("%H:%M:%S,%f")[:-3]
+    m = FPS_RE.search(file_name)
+    return float(m.group(1)) if m else 25.0
+
+# Zero-padded ASCII digits for timestamp fields
+DIGITS2 = [b"%02d" % i for i in range(100)]
+DIGITS3 = [b"%03d" % i for i in range(1000)]
+
+def fmt_srt_bytes(times):
+    # Formats a whole array of times (seconds) as HH:MM:SS,mmm: fields are split in
+    # NumPy, then joined from the digit tables. Truncates to milliseconds from
+    # microsecond resolution, as strftime("%f")[:-3] did
+    ms = np.rint(times * 1_000_000).astype(np.int64) // 1000
+    h, ms = np.divmod(ms, 3_600_000)
+    m, ms = np.divmod(ms, 60_000)
+    s, ms = np.divmod(ms, 1000)
+    return [(DIGITS2[hh] if hh < 100 else b"%d" % hh) + b":" + DIGITS2[mm] + b":"
+            + DIGITS2[ss] + b"," + DIGITS3[mss]
+            for hh, mm, ss, mss in zip(h.tolist(), m.tolist(), s.tolist(), ms.tolist())]
 
 def wrap_text_to_lines(text, max_chars):
+    # Knuth-Plass style optimum fit: fewest lines first (as greedy would give),
+    # then the smallest sum of squared slack so lines come out evenly balanced
     words = text.split()
     if not words:
         return [""]
+    n = len(words)
+    lens = [len(w) for w in words]
+    # Most captions fit on one line; no need to search for breaks
+    if sum(lens) + n - 1 <= max_chars:
+        return [" ".join(words)]
+    # Cost = lines * line_cost + badness; line_cost exceeds any total badness
+    line_cost = n * max(max_chars, max(lens)) ** 2 + 1
+    # cost[j] is the best cost for words[:j]; breaks[j] is where its last line starts
+    cost = [0] * (n + 1)
+    breaks = [0] * (n + 1)
+    for j in range(1, n + 1):
+        best = None
+        width = -1
+        for k in range(j - 1, -1, -1):
+            width += lens[k] + 1
+            # A word longer than max_chars still gets a line to itself
+            if width > max_chars and k < j - 1:
+                break
+            c = cost[k] + line_cost + (max_chars - width) ** 2
+            if best is None or c < best:
+                best = c
+                breaks[j] = k
+        cost[j] = best
     lines = []
-    cur = words[0]
-    for w in words[1:]:
-        if len(cur) + 1 + len(w) <= max_chars:
-            cur += " " + w
-        else:
-            lines.append(cur)
-            cur = w
-    lines.append(cur)
+    j = n
+    while j > 0:
+        k = breaks[j]
+        lines.append(" ".join(words[k:j]))
+        j = k
+    lines.reverse()
     return lines
 
 # -----------------------
 # Main conversion
 # -----------------------
+# Cached on the file bytes and settings, so reruns with unchanged inputs skip the work.
+# Each entry holds a full SRT output, so only the last couple are kept, and not for long
+@st.cache_data(show_spinner=False, max_entries=2, ttl=3600)
 def convert_to_srt(file_content_bytes, file_name,
                    default_last_duration=3,
                    max_chars_per_line=42,
                    max_lines_per_caption=2,
                    custom_suffix="_converted"):
     fps = detect_framerate(file_name)
-    content = file_content_bytes.decode("utf-8")
-    pattern = r"\[(\d{2}:\d{2}:\d{2}\.\d{2})\]\s*(.*)"
-    parsed = []
-    for line in content.splitlines():
-        m = re.match(pattern, line)
-        if m:
-            parsed.append(m.groups())
-
-    if not parsed:
+    frame_s = 1.0 / fps
+    # One pass over the matches straight into start times and texts, without
+    # holding every match's groups in an intermediate list
+    starts, texts = [], []
+    for m in LINE_RE.finditer(file_content_bytes):
+        hh, mm, ss, cs, text = m.groups()
+        starts.append(int(hh)*3600 + int(mm)*60 + int(ss) + int(cs)/100)
+        texts.append(text)
+
+    if not texts:
         raise ValueError("No valid timecodes found. Use format: [HH:MM:SS.xx] Text")
 
-    segments = []
-    for i, (tc, text) in enumerate(parsed):
-        start_dt = parse_timecode(tc)
-        if i + 1 < len(parsed):
-            next_dt = parse_timecode(parsed[i + 1][0])
-            end_dt = next_dt - timedelta(seconds=1 / fps)
+    # Segments as parallel arrays: start, end, duration (seconds) and text
+    starts = np.array(starts)
+    # Microsecond rounding keeps part boundaries stable against float noise
+    ends = np.concatenate([np.round(starts[1:] - frame_s, 6), starts[-1:] + default_last_duration])
+    durations = np.maximum(ends - starts, 0.001)
+
+    # Wrapping is per segment; everything after it runs over flat part arrays
+    n_parts = np.empty(len(texts), dtype=np.int64)
+    part_texts = []
+    for seg_idx, text in enumerate(texts):
+        lines = wrap_text_to_lines(text.decode("utf-8").strip(), max_chars_per_line)
+        if len(lines) <= max_lines_per_caption:
+            n_parts[seg_idx] = 1
+            part_texts.append("\n".join(lines))
         else:
-            end_dt = start_dt + timedelta(seconds=default_last_duration)
-        start_seconds = start_dt.hour*3600 + start_dt.minute*60 + start_dt.second + start_dt.microsecond/1e6
-        end_seconds = end_dt.hour*3600 + end_dt.minute*60 + end_dt.second + end_dt.microsecond/1e6
-        duration = max(end_seconds - start_seconds, 0.001)
-        segments.append({
-            "start_s": start_seconds,
-            "end_s": end_seconds,
-            "duration_s": duration,
-            "text": text.strip()
-        })
-
-    srt_entries = []
-    for seg in segments:
-        lines = wrap_text_to_lines(seg["text"], max_chars_per_line)
-        grouped = [lines[i:i+max_lines_per_caption] for i in range(0, len(lines), max_lines_per_caption)]
-        n_parts = len(grouped)
-        part_duration = seg["duration_s"] / n_parts if n_parts > 0 else seg["duration_s"]
-        for p_idx, group_lines in enumerate(grouped):
-            part_start = seg["start_s"] + p_idx * part_duration
-            part_end = seg["start_s"] + (p_idx + 1) * part_duration - (1.0 / fps)
-            if part_end <= part_start:
-                part_end = part_start + max(0.001, part_duration)
-            start_dt_adj = datetime(1900,1,1) + drop_frame_adjust(part_start, fps)
-            end_dt_adj = datetime(1900,1,1) + drop_frame_adjust(part_end, fps)
-            text_block = "\n".join(group_lines)
-            srt_entries.append({
-                "start_dt": start_dt_adj,
-                "end_dt": end_dt_adj,
-                "text": text_block
-            })
-
-    # Only SRT export now
-    srt_lines = []
-    for idx, e in enumerate(srt_entries, start=1):
-        srt_lines.append(f"{idx}\n{fmt_srt(e['start_dt'])} --> {fmt_srt(e['end_dt'])}\n{e['text']}\n")
-    srt_text = "\n".join(srt_lines)
-    preview = "\n".join(srt_lines[:5]) + ("\n...\n" if len(srt_lines) > 5 else "")
+            n_parts[seg_idx] = (len(lines) + max_lines_per_caption - 1) // max_lines_per_caption
+            part_texts.extend("\n".join(lines[i:i+max_lines_per_caption])
+                              for i in range(0, len(lines), max_lines_per_caption))
+
+    part_duration = np.repeat(durations / n_parts, n_parts)
+    seg_start = np.repeat(starts, n_parts)
+    p_idx = np.arange(len(part_texts)) - np.repeat(np.cumsum(n_parts) - n_parts, n_parts)
+    part_starts = seg_start + p_idx * part_duration
+    part_ends = seg_start + (p_idx + 1) * part_duration - frame_s
+    too_short = part_ends <= part_starts
+    part_ends[too_short] = part_starts[too_short] + np.maximum(0.001, part_duration[too_short])
+
+    if fps in DROP_FRAME_RATES:
+        part_starts = drop_frame_adjust(part_starts, fps)
+        part_ends = drop_frame_adjust(part_ends, fps)
+    start_stamps = fmt_srt_bytes(part_starts)
+    end_stamps = fmt_srt_bytes(part_ends)
+
+    # Only SRT export now; entries are written straight into one buffer and the
+    # encoded bytes go to the download button as-is, never decoded back to a str
+    buf = io.BytesIO()
+    write = buf.write
+    preview = None
+    for idx, (start, end, text) in enumerate(zip(start_stamps, end_stamps, part_texts), start=1):
+        if idx > 1:
+            write(b"\n")
+        write(b"%d\n%b --> %b\n%b\n" % (idx, start, end, text.encode("utf-8")))
+        if idx == 5:
+            preview = buf.getvalue().decode("utf-8")
+    srt_bytes = buf.getvalue()
+    if preview is None:
+        preview = srt_bytes.decode("utf-8")
+    if len(part_texts) > 5:
+        preview += "\n...\n"
     srt_file_name = file_name.rsplit(".", 1)[0] + "_converted.srt"
-    return srt_text, preview, srt_file_name, fps
+    return srt_bytes, preview, srt_file_name, fps
 
 # -----------------------
 # Streamlit UI
@@ -165,8 +213,8 @@ if uploaded_file:
     st.write(f"**Detected frame rate (from filename):** {detect_framerate(uploaded_file.name)} fps")
     if st.button("Convert"):
         try:
-            output_text, preview, file_name_out, fps = convert_to_srt(
-                uploaded_file.read(),
+            output_bytes, preview, file_name_out, fps = convert_to_srt(
+                uploaded_file.getvalue(),
                 uploaded_file.name,
                 default_last_duration=caption_len_default,
                 max_chars_per_line=max_chars,
@@ -178,11 +226,14 @@ if uploaded_file:
 
             st.download_button(
                 label="⬇️ Download",
-                data=output_text,
+                data=output_bytes,
                 file_name=file_name_out,
                 mime="text/plain"
             )
 
-            st.success(f"File generated: {file_name_out} — {len(output_text.splitlines())} total lines.")
+            # Same figure as splitlines(): caption text is re-joined from split() words,
+            # so "\n" is the only line break left in the output
+            line_count = output_bytes.count(b"\n")
+            st.success(f"File generated: {file_name_out} — {line_count} total lines.")
         except Exception as e:
             st.error(f"Conversion error: {e}")